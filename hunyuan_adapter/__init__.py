@@ -4,6 +4,9 @@
 为 LiteLLM Proxy 提供混元大模型的兼容性支持
 """
 
+import importlib.util
+import os
+
 import litellm
 from .cache import ImageCache
 from .fixer import HunyuanMessageFixer, CASCADE_CONFIG
@@ -13,12 +16,27 @@ __version__ = "1.0.0"
 # 全局实例
 _fixer_instance = None
 
+def _configure_http2():
+    """
+    安装了 h2 时开启 litellm 的 HTTP/2 支持
+
+    连接池、SSL 与超时仍由 litellm 自己的 transport 管理；
+    显式设置了 LITELLM_HTTP2 环境变量时以其为准
+    """
+    if "LITELLM_HTTP2" in os.environ:
+        return
+    if importlib.util.find_spec("h2") is not None:
+        litellm.http2 = True
+
 def setup_callbacks():
     """设置并返回回调实例"""
-    global _fixer_instance
+    global _fixer_instance, hunyuan_fixer
+    
+    _configure_http2()
     
     if _fixer_instance is None:
         _fixer_instance = HunyuanMessageFixer()
+        hunyuan_fixer = _fixer_instance
     
     if _fixer_instance not in litellm.callbacks:
         litellm.callbacks.append(_fixer_instance)
@@ -1,9 +1,69 @@
 """图片缓存模块"""
 
+import functools
 import hashlib
 import time
-from collections import OrderedDict
-from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from cachetools import TTLCache
+
+# base64 数据分块哈希的块大小
+_HASH_CHUNK_SIZE = 64 * 1024
+
+# 图片 URL 前缀
+_B64_PREFIX = "data:image/"
+_HTTP_PREFIX = "http"
+_IMAGE_URL_PREFIXES = (_B64_PREFIX, _HTTP_PREFIX)
+
+# delete() 中区分"不存在"与任意缓存值的哨兵
+_MISSING = object()
+
+
+def _stable_digest(text):
+    """跨进程稳定的 64 位摘要（替代随进程加盐的 hash()）"""
+    return hashlib.blake2b(str(text).encode('utf-8', 'backslashreplace'), digest_size=8).hexdigest()
+
+
+def _classify_url(url):
+    """判断图片 URL 类型：b64 / http / unknown"""
+    if not url or not url.startswith(_IMAGE_URL_PREFIXES):
+        return "unknown"
+    return "b64" if url.startswith(_B64_PREFIX) else "http"
+
+
+@functools.lru_cache(maxsize=4096)
+def _url_cache_key(url):
+    """为URL图片生成规范化键（纯函数，按 URL 缓存结果，同一图片跨请求复用）"""
+    # 快速路径：大多数图片 URL 没有查询参数和 fragment，无需解析
+    if "?" not in url and "#" not in url:
+        return f"img_url_{_stable_digest(url)}"
+    
+    try:
+        parts = urlsplit(url)
+        # 规范化查询参数（排序），忽略不会发送到服务器的 fragment
+        normalized_query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+        normalized_url = urlunsplit((parts.scheme, parts.netloc, parts.path, normalized_query, ""))
+        
+        # 使用稳定的 64 位摘要，避免 hash() 跨进程不一致和取模碰撞
+        return f"img_url_{_stable_digest(normalized_url)}"
+    except Exception:
+        # 如果解析失败，使用简单哈希
+        return f"img_url_{_stable_digest(url)}"
+
+
+class _CountingTTLCache(TTLCache):
+    """记录容量淘汰次数的 TTLCache"""
+    
+    def __init__(self, maxsize, ttl, stats):
+        super().__init__(maxsize=maxsize, ttl=ttl, timer=time.monotonic)
+        self._stats = stats
+    
+    def popitem(self):
+        # 仅在缓存已满需要淘汰时被调用
+        item = super().popitem()
+        self._stats['evictions'] += 1
+        return item
+
 
 class ImageCache:
     """LRU 图片缓存，支持 TTL 过期"""
@@ -11,13 +71,13 @@ class ImageCache:
     def __init__(self, max_size=1000, ttl=3600):
         self.max_size = max_size
         self.ttl = ttl
-        self.cache = OrderedDict()
         self.stats = {
             'hits': 0,
             'misses': 0,
             'evictions': 0,
             'size': 0
         }
+        self.cache = _CountingTTLCache(max_size, ttl, self.stats)
     
     def generate_cache_key(self, image_content):
         """生成缓存键（原 _generate_cache_key）"""
@@ -34,130 +94,94 @@ class ImageCache:
         
         # 处理图片列表
         if isinstance(image_content, list):
-            keys = []
-            for img in image_content:
-                key = self._generate_single_image_key(img)
-                if key:
-                    keys.append(key)
+            keys = self.generate_image_keys(image_content)
             return "|".join(keys) if keys else None
         
         return None
     
+    def generate_image_keys(self, images):
+        """为图片列表逐张生成缓存键（与 images 一一对应）"""
+        return [self._generate_single_image_key(img) for img in images]
+    
     def _generate_single_image_key(self, image_item):
-        """为单张图片生成缓存键"""
+        """为单张图片生成缓存键（始终根据图片内容计算，不读取请求中的任何字段作为键）"""
         image_url = image_item.get("image_url", {})
         if isinstance(image_url, dict):
             url = image_url.get("url", "")
         else:
             url = str(image_url)
         
-        if url.startswith("data:image/"):
-            # Base64图片：提取数据部分并计算SHA256
+        url_type = _classify_url(url)
+        if url_type == "b64":
+            # Base64图片：提取数据部分并计算 BLAKE2b 哈希
             return self._generate_base64_key(url)
-        elif url.startswith("http"):
+        elif url_type == "http":
             # URL图片：规范化URL
             return self._generate_url_key(url)
         else:
             # 其他情况
-            return f"img_unknown_{hash(url) % 1000000}"
+            return f"img_unknown_{_stable_digest(url)}"
     
     def _generate_base64_key(self, data_url):
-        """为base64图片生成SHA256哈希键"""
+        """为base64图片生成 BLAKE2b 哈希键"""
         try:
-            # 提取base64数据部分
-            if "," in data_url:
-                header, data_part = data_url.split(",", 1)
-            else:
-                data_part = data_url
+            # 定位base64数据部分的起始位置（没有逗号时 find 返回 -1，即从头开始），
+            # 不对整段数据做 split 复制
+            start = data_url.find(",") + 1
             
-            # 计算SHA256哈希
-            hash_obj = hashlib.sha256(data_part.encode('utf-8'))
+            # 分块计算 BLAKE2b 哈希（比 SHA256 更快），避免为大图分配完整的编码副本
+            # （base64 为纯 ASCII，非法字符转义后参与哈希）
+            hash_obj = hashlib.blake2b(digest_size=16)
+            for i in range(start, len(data_url), _HASH_CHUNK_SIZE):
+                hash_obj.update(data_url[i:i + _HASH_CHUNK_SIZE].encode('ascii', 'backslashreplace'))
             hash_hex = hash_obj.hexdigest()
             return f"img_b64_{hash_hex}"
         except Exception:
             # 如果解析失败，使用备用方案
-            return f"img_b64_{hash(data_url) % 1000000}"
+            return f"img_b64_{_stable_digest(data_url)}"
     
     def _generate_url_key(self, url):
         """为URL图片生成规范化键"""
-        try:
-            parsed = urlparse(url)
-            # 规范化查询参数（排序）
-            if parsed.query:
-                params = parse_qs(parsed.query)
-                normalized_query = urlencode(sorted(params.items()), doseq=True)
-            else:
-                normalized_query = ""
-            
-            # 重建规范化URL
-            normalized_url = urlunparse((
-                parsed.scheme,
-                parsed.netloc,
-                parsed.path,
-                parsed.params,
-                normalized_query,
-                parsed.fragment
-            ))
-            
-            return f"img_url_{hash(normalized_url) % 1000000}"
-        except Exception:
-            # 如果解析失败，使用简单哈希
-            return f"img_url_{hash(url) % 1000000}"
+        return _url_cache_key(url)
     
     def get(self, key):
-        """获取缓存项"""
-        if key not in self.cache:
-            self.stats['misses'] += 1
-            return None
-        
-        entry = self.cache[key]
-        # 检查TTL
-        if time.time() - entry['timestamp'] > self.ttl:
-            del self.cache[key]
+        """获取缓存项（过期项由 TTLCache 自动清除）"""
+        try:
+            value = self.cache[key]
+        except KeyError:
             self.stats['misses'] += 1
-            self.stats['evictions'] += 1
             return None
         
-        # 移动到末尾（LRU）
-        self.cache.move_to_end(key)
         self.stats['hits'] += 1
-        return entry['value']
+        return value
     
     def set(self, key, value):
         """设置缓存项"""
         if key is None:
             return
-            
-        # 如果缓存已满，移除最老的条目
-        if len(self.cache) >= self.max_size and key not in self.cache:
-            oldest_key = next(iter(self.cache))
-            del self.cache[oldest_key]
-            self.stats['evictions'] += 1
         
-        self.cache[key] = {
-            'value': value,
-            'timestamp': time.time()
-        }
-        self.cache.move_to_end(key)
+        # 缓存已满时由 TTLCache 按 LRU 淘汰
+        self.cache[key] = value
         self.stats['size'] = len(self.cache)
     
     def delete(self, key):
         """删除特定缓存项"""
-        if key in self.cache:
-            del self.cache[key]
-            self.stats['size'] = len(self.cache)
-            return True
-        return False
+        # 单次查找完成判断与删除
+        if self.cache.pop(key, _MISSING) is _MISSING:
+            return False
+        self.stats['size'] = len(self.cache)
+        return True
     
     def clear(self):
         """清空缓存"""
         self.cache.clear()
-        self.stats = {
+        # 原地重置，_CountingTTLCache 持有同一个 stats 引用
+        self.stats.update({
             'hits': 0,
             'misses': 0,
             'evictions': 0,
             'size': 0
-        }
+        })
     
     def get_stats(self):
         """获取缓存统计"""
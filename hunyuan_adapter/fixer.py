@@ -1,16 +1,18 @@
 """混元消息修正回调模块"""
 
 import os
-import copy
+import asyncio
+import logging
 import litellm
-import time
 from litellm.integrations.custom_logger import CustomLogger
 from dotenv import load_dotenv
 
-from .cache import ImageCache
+from .cache import ImageCache, _classify_url, _stable_digest, _IMAGE_URL_PREFIXES
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # 配置
 CASCADE_CONFIG = {
     "vision_model": "hunyuan-vision-1.5-instruct",
@@ -20,8 +22,51 @@ CASCADE_CONFIG = {
     "cache_max_size": 1000,
     "cache_ttl": 3600,
     "enable_cache_logging": True,
+    "max_concurrency": 8,
+    "vision_timeout": 60,
 }
 
+# 混元不支持的请求参数
+_UNSUPPORTED_PARAMS = frozenset((
+    "parallel_tool_calls",  # 混元不支持并行工具调用
+    "reasoning_effort",     # 混元不支持
+))
+
+# 各角色空 content 的默认填充内容
+_EMPTY_CONTENT_DEFAULTS = {
+    "assistant": "好的，我来处理。",
+    "user": "请继续。",
+    "system": "你是一个有帮助的AI助手。",
+    "tool": "工具执行完成。",
+}
+
+# 空 content 的 assistant 消息最多列出的工具名数量
+_MAX_LISTED_TOOL_NAMES = 3
+
+def _assistant_default_content(msg: dict) -> str:
+    """为空 content 的 assistant 消息生成填充内容，有 tool_calls 时列出工具名"""
+    tool_calls = msg.get("tool_calls")
+    if not tool_calls:
+        return _EMPTY_CONTENT_DEFAULTS["assistant"]
+    # 只列出前几个工具名，其余以省略号表示
+    tool_names = [
+        tc["function"].get("name", "unknown")
+        for tc in tool_calls[:_MAX_LISTED_TOOL_NAMES]
+        if isinstance(tc, dict) and "function" in tc
+    ]
+    suffix = ", ..." if len(tool_calls) > _MAX_LISTED_TOOL_NAMES else ""
+    return f"我将调用工具：{', '.join(tool_names)}{suffix}"
+
+def _content_preview(content, limit=100):
+    """生成日志用的 content 预览，避免对多模态内容（含 base64 图片）整体 str()"""
+    if not content:
+        return ""
+    if isinstance(content, str):
+        return content[:limit] + "..." if len(content) > limit else content
+    if isinstance(content, list):
+        return f"<multimodal parts={len(content)}>"
+    return repr(content)[:limit]
+
 class HunyuanMessageFixer(CustomLogger):
     """LiteLLM 自定义回调：消息格式修正 + 级联处理"""
     
@@ -32,23 +77,44 @@ class HunyuanMessageFixer(CustomLogger):
         cache_ttl = CASCADE_CONFIG.get("cache_ttl", 3600)
         self.image_cache = ImageCache(max_size=cache_max_size, ttl=cache_ttl)
         self.enable_cache_logging = CASCADE_CONFIG.get("enable_cache_logging", True)
+        # 视觉模型并发上限，信号量在首次使用时创建
+        self.max_concurrency = CASCADE_CONFIG.get("max_concurrency", 8)
+        self._vision_sem = None
+        # 进行中的视觉模型调用：缓存键 -> Task
+        self._inflight = {}
+        # 预先绑定模型与接口配置，避免热路径上重复查询 CASCADE_CONFIG
+        self._vision_model = CASCADE_CONFIG["vision_model"]
+        self._text_model = CASCADE_CONFIG["text_model"]
+        self._api_key = CASCADE_CONFIG["api_key"]
+        self._api_base = CASCADE_CONFIG["api_base"]
+        # 视觉模型调用的固定参数，每次调用只需补充 messages
+        self._acompletion = litellm.acompletion
+        self._vision_kwargs = {
+            "model": f"openai/{self._vision_model}",
+            "api_key": self._api_key,
+            "api_base": self._api_base,
+            "max_tokens": 2000,
+            # 视觉模型每次请求尝试的超时（秒），否则沿用 litellm 默认的 request_timeout（6000 秒）
+            "timeout": CASCADE_CONFIG.get("vision_timeout", 60),
+        }
     
     def _contains_image(self, content) -> bool:
         """检测内容中是否包含图片"""
-        if isinstance(content, list):
-            for item in content:
-                if isinstance(item, dict):
-                    if item.get("type") == "image_url":
+        if isinstance(content, str):
+            return _classify_url(content) == "b64"
+        if not isinstance(content, list):
+            return False
+        for item in content:
+            if type(item) is dict:
+                # type 字段可直接判定，无需再检查 url
+                if item.get("type") == "image_url":
+                    return True
+                # 检查 image_url 中的 url
+                image_url = item.get("image_url")
+                if type(image_url) is dict:
+                    url = image_url.get("url")
+                    if type(url) is str and url.startswith(_IMAGE_URL_PREFIXES):
                         return True
-                    # 检查 image_url 中的 url
-                    image_url = item.get("image_url", {})
-                    if isinstance(image_url, dict):
-                        url = image_url.get("url", "")
-                        if url.startswith("data:image/") or url.startswith("http"):
-                            return True
-        elif isinstance(content, str):
-            if content.startswith("data:image/"):
-                return True
         return False
     
     def _extract_images_from_content(self, content) -> tuple:
@@ -61,43 +127,60 @@ class HunyuanMessageFixer(CustomLogger):
         
         if isinstance(content, list):
             for item in content:
-                if isinstance(item, dict):
+                if type(item) is dict:
                     if item.get("type") == "image_url":
                         images.append(item)
                     elif item.get("type") == "text":
                         text_parts.append(item.get("text", ""))
-                elif isinstance(item, str):
+                elif type(item) is str:
                     text_parts.append(item)
         elif isinstance(content, str):
-            if content.startswith("data:image/"):
+            if _classify_url(content) == "b64":
                 images.append({"type": "image_url", "image_url": {"url": content}})
             else:
                 text_parts.append(content)
         
         return images, " ".join(text_parts)
     
+    def _image_flags(self, messages: list) -> list:
+        """逐条标记消息是否包含图片，结果供级联处理复用以免重复扫描"""
+        contains_image = self._contains_image
+        return [contains_image(msg.get("content")) for msg in messages]
+    
     def _has_images_in_messages(self, messages: list) -> bool:
         """检查消息列表中是否包含图片"""
-        for msg in messages:
-            content = msg.get("content")
-            if self._contains_image(content):
-                return True
-        return False
+        contains_image = self._contains_image
+        return any(contains_image(msg.get("content")) for msg in messages)
     
-    async def _analyze_image_with_vision_model(self, image_content: list, context_text: str) -> str:
+    @staticmethod
+    def _vision_image_parts(image_content: list, image_keys: list) -> list:
         """
-        使用视觉模型分析图片（带缓存）
+        生成发送给视觉模型的图片部分：同一张图片只发送一次
+
+        image_keys 为 ImageCache.generate_image_keys 根据图片内容计算的键，与 image_content 一一对应
+        """
+        parts = []
+        seen = set()
+        for img, key in zip(image_content, image_keys):
+            if key in seen:
+                continue
+            seen.add(key)
+            parts.append(img)
+        return parts
+    
+    async def _analyze_image_with_vision_model(self, image_content: list, context_text: str, cache_key=None, image_keys=None) -> str:
+        """
+        使用视觉模型分析图片，成功的结果写入缓存
         返回图片的文本描述
+
+        缓存查询由调用方负责；cache_key / image_keys 未提供时根据图片生成
         """
         try:
             # 生成缓存键
-            cache_key = self.image_cache.generate_cache_key(image_content)
-            if cache_key:
-                # 检查缓存
-                cached_result = self.image_cache.get(cache_key)
-                if cached_result:
-                    print(f"[HunyuanCascade] 缓存命中，返回缓存的图片分析结果")
-                    return cached_result
+            if image_keys is None:
+                image_keys = self.image_cache.generate_image_keys(image_content)
+            if cache_key is None:
+                cache_key = self.image_cache.generate_cache_key(image_content)
             
             # 构建视觉模型请求
             vision_messages = [
@@ -105,25 +188,24 @@ class HunyuanMessageFixer(CustomLogger):
                     "role": "user",
                     "content": [
                         {"type": "text", "text": f"请详细描述这张图片的内容，包括所有可见的文字、代码、图表、界面元素等。用户的问题是：{context_text}"},
-                        *image_content
+                        *self._vision_image_parts(image_content, image_keys)
                     ]
                 }
             ]
             
-            print(f"[HunyuanCascade] 调用视觉模型分析图片...")
+            logger.debug("[HunyuanCascade] 调用视觉模型分析图片...")
             
             # 调用视觉模型
-            response = await litellm.acompletion(
-                model=f"openai/{CASCADE_CONFIG['vision_model']}",
-                messages=vision_messages,
-                api_key=CASCADE_CONFIG["api_key"],
-                api_base=CASCADE_CONFIG["api_base"],
-                max_tokens=2000,
-            )
+            response = await self._acompletion(messages=vision_messages, **self._vision_kwargs)
             
-            # 处理响应
-            description = str(response)
-            print(f"[HunyuanCascade] 图片分析完成，描述长度: {len(description)}")
+            # 处理响应：只取模型输出的文本，取不到时退回完整响应
+            try:
+                description = response.choices[0].message.content or ""
+            except (AttributeError, IndexError, TypeError):
+                description = ""
+            if not description:
+                description = str(response)
+            logger.debug("[HunyuanCascade] 图片分析完成，描述长度: %d", len(description))
             
             # 存入缓存
             if cache_key:
@@ -132,124 +214,186 @@ class HunyuanMessageFixer(CustomLogger):
             return description
             
         except Exception as e:
-            print(f"[HunyuanCascade] 视觉模型调用失败: {e}")
+            logger.warning("[HunyuanCascade] 视觉模型调用失败: %s", e)
             return f"[图片分析失败: {str(e)}]"
     
     def clear_image_cache(self):
         """清空图片缓存"""
         self.image_cache.clear()
-        print(f"[HunyuanCascade] 图片缓存已清空")
+        logger.info("[HunyuanCascade] 图片缓存已清空")
     
     def get_cache_stats(self):
         """获取缓存统计信息"""
         stats = self.image_cache.get_stats()
         if self.enable_cache_logging:
-            print(f"[CacheStats] 命中率: {stats['hit_rate']}%, 命中: {stats['hits']}, 未命中: {stats['misses']}, 大小: {stats['size']}/{stats['max_size']}")
+            logger.info(
+                "[CacheStats] 命中率: %s%%, 命中: %d, 未命中: %d, 大小: %d/%d",
+                stats['hit_rate'], stats['hits'], stats['misses'], stats['size'], stats['max_size'],
+            )
         return stats
     
     def delete_cache_entry(self, cache_key):
         """删除特定缓存项"""
         success = self.image_cache.delete(cache_key)
         if success:
-            print(f"[HunyuanCascade] 缓存项已删除: {cache_key}")
+            logger.info("[HunyuanCascade] 缓存项已删除: %s", cache_key)
         else:
-            print(f"[HunyuanCascade] 缓存项不存在: {cache_key}")
+            logger.info("[HunyuanCascade] 缓存项不存在: %s", cache_key)
         return success
     
-    async def _process_cascade(self, data: dict) -> dict:
+    async def _analyze_with_limit(self, image_content: list, context_text: str, cache_key=None, image_keys=None) -> str:
+        """
+        在并发信号量限制下调用视觉模型
+        相同缓存键的并发请求共享同一次调用结果
+        """
+        if cache_key:
+            inflight = self._inflight.get(cache_key)
+            if inflight is not None:
+                logger.debug("[HunyuanCascade] 复用进行中的视觉模型调用")
+                return await asyncio.shield(inflight)
+        
+        task = asyncio.ensure_future(self._analyze_limited(image_content, context_text, cache_key, image_keys))
+        if cache_key:
+            self._inflight[cache_key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(cache_key, None))
+        # shield 保证单个等待方被取消时不会中断其他等待方共享的调用
+        return await asyncio.shield(task)
+    
+    async def _analyze_limited(self, image_content: list, context_text: str, cache_key=None, image_keys=None) -> str:
+        """持有信号量执行视觉模型调用"""
+        if self._vision_sem is None:
+            # 信号量需在运行中的事件循环内创建
+            self._vision_sem = asyncio.Semaphore(self.max_concurrency)
+        async with self._vision_sem:
+            return await self._analyze_image_with_vision_model(image_content, context_text, cache_key, image_keys)
+    
+    async def _process_cascade(self, data: dict, image_flags=None) -> dict:
         """
         级联处理：图片先由视觉模型分析，然后转为文本给文本模型处理（带缓存）
+        
+        image_flags 为 _image_flags 的结果，未提供时重新扫描消息
+        
+        所有未命中缓存的视觉模型调用会并发执行（受 max_concurrency 限制）
         """
         messages = data.get("messages", [])
-        processed_messages = []
+        if image_flags is None:
+            image_flags = self._image_flags(messages)
         
-        for msg in messages:
+        # 第一遍：提取图片并查询缓存
+        # 每项为 (消息索引, 图片列表, 单图缓存键列表, 文本, 缓存键, 缓存结果)
+        entries = []
+        for idx, msg in enumerate(messages):
+            if not image_flags[idx]:
+                continue
             content = msg.get("content")
-            role = msg.get("role")
             
-            if self._contains_image(content):
-                # 提取图片和文本
-                images, text = self._extract_images_from_content(content)
+            # 提取图片和文本
+            images, text = self._extract_images_from_content(content)
+            if not images:
+                continue
+            
+            # 为批量图片生成缓存键（包含上下文信息）
+            full_cache_key = None
+            cached_result = None
+            # 单图键只在此处根据图片内容计算一次，并向下传递（不在请求的图片字典上记录）
+            image_keys = self.image_cache.generate_image_keys(images)
+            cache_key = "|".join(image_keys) if image_keys else None
+            if cache_key:
+                # 在缓存键中包含上下文摘要以确保准确性
+                # （_stable_digest 跨进程稳定，不会像 hash() % 1000000 那样频繁碰撞，
+                #  且能处理 JSON 中合法的孤立代理字符）
+                context_hash = _stable_digest(text)
+                full_cache_key = f"{cache_key}_ctx_{context_hash}"
                 
-                if images:
-                    # 为批量图片生成缓存键（包含上下文信息）
-                    cache_key = self.image_cache.generate_cache_key(images)
-                    if cache_key:
-                        # 在缓存键中包含上下文摘要以确保准确性
-                        context_hash = hash(text) % 1000000
-                        full_cache_key = f"{cache_key}_ctx_{context_hash}"
-                        
-                        # 检查缓存
-                        cached_result = self.image_cache.get(full_cache_key)
-                        if cached_result:
-                            print(f"[HunyuanCascade] 级联处理缓存命中")
-                            description = cached_result
-                        else:
-                            # 调用视觉模型分析图片
-                            description = await self._analyze_image_with_vision_model(images, text)
-                            # 存入缓存
-                            self.image_cache.set(full_cache_key, description)
-                    else:
-                        # 调用视觉模型分析图片
-                        description = await self._analyze_image_with_vision_model(images, text)
-                    
-                    # 用图片描述替换原内容
-                    new_content = f"{text}\n\n[图片内容描述]:\n{description}"
-                    
-                    processed_messages.append({
-                        **msg,
-                        "content": new_content
-                    })
-                    print(f"[HunyuanCascade] 已将图片转换为文本描述")
-                else:
-                    processed_messages.append(msg)
-            else:
-                processed_messages.append(msg)
+                # 检查缓存
+                cached_result = self.image_cache.get(full_cache_key)
+                if cached_result:
+                    logger.debug("[HunyuanCascade] 级联处理缓存命中")
+            
+            entries.append((idx, images, image_keys, text, full_cache_key, cached_result))
+        
+        # 第二遍：并发调用视觉模型分析未命中缓存的图片
+        pending = [entry for entry in entries if not entry[5]]
+        if pending:
+            logger.debug("[HunyuanCascade] 并发分析 %d 条消息中的图片", len(pending))
+            results = await asyncio.gather(
+                *(
+                    self._analyze_with_limit(images, text, full_cache_key, image_keys)
+                    for _, images, image_keys, text, full_cache_key, _ in pending
+                ),
+                return_exceptions=True,
+            )
+            fresh = {}
+            for (idx, _, _, _, _, _), result in zip(pending, results):
+                # 成功的结果已由 _analyze_image_with_vision_model 写入缓存
+                if isinstance(result, BaseException):
+                    logger.warning("[HunyuanCascade] 视觉模型调用失败: %s", result)
+                    result = f"[图片分析失败: {str(result)}]"
+                fresh[idx] = result
+        
+        # 第三遍：用图片描述替换原内容
+        processed_messages = list(messages)
+        for idx, _, _, text, _, cached_result in entries:
+            description = cached_result if cached_result else fresh[idx]
+            new_content = f"{text}\n\n[图片内容描述]:\n{description}"
+            processed_messages[idx] = {
+                **messages[idx],
+                "content": new_content
+            }
+            logger.debug("[HunyuanCascade] 已将图片转换为文本描述")
         
         data["messages"] = processed_messages
         
         # 强制使用文本模型（支持工具调用）
         original_model = data.get("model", "")
-        data["model"] = CASCADE_CONFIG["text_model"]
-        print(f"[HunyuanCascade] 模型切换: {original_model} -> {CASCADE_CONFIG['text_model']}")
+        data["model"] = self._text_model
+        logger.debug("[HunyuanCascade] 模型切换: %s -> %s", original_model, self._text_model)
         
         return data
     
-    def _ensure_content_not_empty(self, msg: dict) -> dict:
-        """确保消息的 content 不为空"""
-        msg = copy.deepcopy(msg)
+    @staticmethod
+    def _is_empty(msg: dict) -> bool:
+        """检查消息的 content 是否为空"""
         content = msg.get("content")
-        role = msg.get("role", "")
-        
-        # 检查 content 是否为空
-        is_empty = False
         if content is None:
-            is_empty = True
-        elif isinstance(content, str) and not content.strip():
-            is_empty = True
-        elif isinstance(content, list) and len(content) == 0:
-            is_empty = True
+            return True
+        if isinstance(content, str):
+            return not content.strip()
+        if isinstance(content, list):
+            return len(content) == 0
+        return False
+    
+    @staticmethod
+    def _is_clean_tool(tool) -> bool:
+        """检查工具定义是否已兼容混元（为字典且 function 中没有 strict 字段）"""
+        if type(tool) is not dict:
+            return False
+        function = tool.get("function")
+        return not (type(function) is dict and "strict" in function)
+    
+    @staticmethod
+    def _clean_tool(tool: dict) -> dict:
+        """移除 function 中的 strict 字段，仅在存在时重建 tool 与 function 字典"""
+        function = tool.get("function")
+        if type(function) is dict and "strict" in function:
+            return {**tool, "function": {k: v for k, v in function.items() if k != "strict"}}
+        return tool
+    
+    def _ensure_content_not_empty(self, msg: dict, role=None) -> dict:
+        """确保消息的 content 不为空（仅在需要修复时复制消息），role 可由调用方传入"""
+        if not self._is_empty(msg):
+            return msg
         
-        if is_empty:
-            if role == "assistant":
-                if msg.get("tool_calls"):
-                    # 从 tool_calls 生成描述
-                    tool_names = []
-                    for tc in msg.get("tool_calls", []):
-                        if isinstance(tc, dict) and "function" in tc:
-                            tool_names.append(tc["function"].get("name", "unknown"))
-                    msg["content"] = f"我将调用工具：{', '.join(tool_names)}"
-                else:
-                    msg["content"] = "好的，我来处理。"
-            elif role == "user":
-                msg["content"] = "请继续。"
-            elif role == "system":
-                msg["content"] = "你是一个有帮助的AI助手。"
-            elif role == "tool":
-                msg["content"] = "工具执行完成。"
-            else:
-                msg["content"] = "..."
-            print(f"[HunyuanFixer] 修复空 content: role={role}")
+        # 只会替换顶层 content 字段，浅拷贝即可
+        msg = dict(msg)
+        if role is None:
+            role = msg.get("role", "")
+        
+        if role == "assistant":
+            msg["content"] = _assistant_default_content(msg)
+        else:
+            msg["content"] = _EMPTY_CONTENT_DEFAULTS.get(role, "...")
+        logger.debug("[HunyuanFixer] 修复空 content: role=%s", role)
         
         return msg
     
@@ -267,53 +411,68 @@ class HunyuanMessageFixer(CustomLogger):
         if not messages:
             return messages
         
-        messages = copy.deepcopy(messages)
-        
         # 打印调试信息
-        roles = [m.get("role") for m in messages]
-        print(f"[HunyuanFixer] 原始消息角色列表: {roles}")
+        debug_enabled = logger.isEnabledFor(logging.DEBUG)
+        if debug_enabled:
+            logger.debug("[HunyuanFixer] 原始消息角色列表: %s", [m.get("role") for m in messages])
+        
+        # 快速路径：逐条检查，遇到第一个问题（空 content 或 tool→user 相邻）即停止；
+        # 全部满足且不以 assistant 结尾时直接返回原列表，不做任何复制
+        is_empty = self._is_empty
+        prev_role = None
+        for m in messages:
+            role = m.get("role")
+            if is_empty(m) or (prev_role == "tool" and role == "user"):
+                break
+            prev_role = role
+        else:
+            if prev_role != "assistant":
+                logger.debug("[HunyuanFixer] 消息序列已满足混元约束，跳过修正")
+                return messages
         
         # 策略：保留工具调用链，在 tool→user 之间插入过渡 assistant 消息
+        # 单次遍历完成空 content 修复、过渡消息插入与角色跟踪
         fixed_messages = []
+        # 插入过渡消息会改变长度，无法预分配；提前绑定 append 减少循环内的属性查找
+        append = fixed_messages.append
+        ensure_content = self._ensure_content_not_empty
+        prev_role = None
         
-        for i, msg in enumerate(messages):
+        for msg in messages:
             role = msg.get("role")
             
-            # 确保消息 content 不为空
-            msg = self._ensure_content_not_empty(msg)
-            
-            # 添加当前消息
-            fixed_messages.append(msg)
-            
             # 检查是否需要在 tool 和 user 之间插入 assistant
-            if role == "tool" and i + 1 < len(messages):
-                next_msg = messages[i + 1]
-                if next_msg.get("role") == "user":
-                    # 在 tool 和 user 之间插入一个过渡 assistant 消息
-                    tool_content = msg.get("content", "")
-                    # 生成简短的工具结果摘要
-                    if len(str(tool_content)) > 200:
-                        summary = str(tool_content)[:200] + "..."
-                    else:
-                        summary = tool_content if tool_content else "工具执行完成"
-                    
-                    transition_msg = {
-                        "role": "assistant",
-                        "content": f"工具返回了结果。{str(summary)[:100]}"
-                    }
-                    fixed_messages.append(transition_msg)
-                    print(f"[HunyuanFixer] 在 tool 和 user 之间插入 assistant 消息")
+            if role == "user" and prev_role == "tool":
+                # 在 tool 和 user 之间插入一个过渡 assistant 消息
+                tool_content = fixed_messages[-1].get("content", "")
+                # 生成简短的工具结果摘要（只转换一次字符串并截取一次）
+                if not tool_content:
+                    summary = "工具执行完成"
+                elif type(tool_content) is str:
+                    summary = tool_content[:100]
+                else:
+                    summary = str(tool_content)[:100]
+                
+                transition_msg = {
+                    "role": "assistant",
+                    "content": f"工具返回了结果。{summary}"
+                }
+                append(transition_msg)
+                logger.debug("[HunyuanFixer] 在 tool 和 user 之间插入 assistant 消息")
+            
+            # 确保消息 content 不为空，并添加当前消息
+            append(ensure_content(msg, role))
+            prev_role = role
         
         # 确保消息以 user 或 tool 结尾
-        if fixed_messages:
-            last_role = fixed_messages[-1].get("role")
-            print(f"[HunyuanFixer] 修正后最后一条消息角色: {last_role}")
-            if last_role == "assistant":
-                print(f"[HunyuanFixer] 添加 user 消息使序列以 user 结尾")
-                fixed_messages.append({"role": "user", "content": "请继续。"})
+        # （过渡消息只插入在中间，最后一条消息的角色即 prev_role）
+        logger.debug("[HunyuanFixer] 修正后最后一条消息角色: %s", prev_role)
+        if prev_role == "assistant":
+            logger.debug("[HunyuanFixer] 添加 user 消息使序列以 user 结尾")
+            append({"role": "user", "content": "请继续。"})
         
-        final_roles = [m.get("role") for m in fixed_messages]
-        print(f"[HunyuanFixer] 最终消息角色列表: {final_roles}")
+        if debug_enabled:
+            logger.debug("[HunyuanFixer] 最终消息角色列表: %s", [m.get("role") for m in fixed_messages])
         
         return fixed_messages
     
@@ -325,62 +484,68 @@ class HunyuanMessageFixer(CustomLogger):
         call_type: str,
     ):
         """在 LLM 调用之前修改请求数据"""
-        print(f"[HunyuanFixer] async_pre_call_hook 被调用, call_type={call_type}")
+        logger.debug("[HunyuanFixer] async_pre_call_hook 被调用, call_type=%s", call_type)
         
         # 只处理 chat completion 请求
         if call_type == "completion" or call_type == "acompletion":
             model_name = data.get("model", "")
-            print(f"[HunyuanFixer] 请求模型: {model_name}")
+            logger.debug("[HunyuanFixer] 请求模型: %s", model_name)
             
             # 检查是否包含图片
-            has_images = self._has_images_in_messages(data.get("messages", []))
+            image_flags = self._image_flags(data.get("messages", []))
             
-            if has_images:
-                print(f"[HunyuanCascade] 检测到图片内容，启动级联处理")
+            if any(image_flags):
+                logger.debug("[HunyuanCascade] 检测到图片内容，启动级联处理")
                 # 级联处理：先用视觉模型分析图片，再用文本模型处理
-                data = await self._process_cascade(data)
+                data = await self._process_cascade(data, image_flags)
             
             # 记录完整的原始请求（用于调试）
-            print(f"[HunyuanFixer] ====== 处理后请求 ======")
-            print(f"[HunyuanFixer] messages 数量: {len(data.get('messages', []))}")
-            for i, msg in enumerate(data.get("messages", [])):
-                role = msg.get("role")
-                content = msg.get("content")
-                tool_calls = msg.get("tool_calls")
-                tool_call_id = msg.get("tool_call_id")
-                
-                # 截断 content 用于日志
-                content_str = str(content) if content else ""
-                content_preview = content_str[:100] + "..." if len(content_str) > 100 else content_str
-                
-                print(f"[HunyuanFixer] msg[{i}]: role={role}, content={content_preview}, tool_calls={bool(tool_calls)}, tool_call_id={tool_call_id}")
-            print(f"[HunyuanFixer] ====== 处理后请求结束 ======")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[HunyuanFixer] ====== 处理后请求 ======")
+                logger.debug("[HunyuanFixer] messages 数量: %d", len(data.get('messages', [])))
+                for i, msg in enumerate(data.get("messages", [])):
+                    role = msg.get("role")
+                    content = msg.get("content")
+                    tool_calls = msg.get("tool_calls")
+                    tool_call_id = msg.get("tool_call_id")
+                    
+                    # 截断 content 用于日志
+                    content_preview = _content_preview(content)
+                    
+                    logger.debug(
+                        "[HunyuanFixer] msg[%d]: role=%s, content=%s, tool_calls=%s, tool_call_id=%s",
+                        i, role, content_preview, bool(tool_calls), tool_call_id,
+                    )
+                logger.debug("[HunyuanFixer] ====== 处理后请求结束 ======")
             
             # 修正消息（确保以 user 或 tool 结尾等）
             if "messages" in data:
                 data["messages"] = self._fix_messages(data["messages"])
             
             # 移除混元不支持的参数
-            unsupported_params = [
-                "parallel_tool_calls",  # 混元不支持并行工具调用
-                "reasoning_effort",     # 混元不支持
-            ]
-            for param in unsupported_params:
-                if param in data:
-                    print(f"[HunyuanFixer] 移除参数: {param}")
-                    data.pop(param, None)
+            for param in _UNSUPPORTED_PARAMS.intersection(data):
+                logger.debug("[HunyuanFixer] 移除参数: %s", param)
+                data.pop(param, None)
             
             # 清理 tools 参数中混元不支持的字段
             if "tools" in data:
-                cleaned_tools = []
-                for tool in data.get("tools", []):
-                    if isinstance(tool, dict):
-                        cleaned_tool = copy.deepcopy(tool)
-                        # 移除 function 中的 strict 字段
-                        if "function" in cleaned_tool and isinstance(cleaned_tool["function"], dict):
-                            cleaned_tool["function"].pop("strict", None)
-                        cleaned_tools.append(cleaned_tool)
-                data["tools"] = cleaned_tools
-                print(f"[HunyuanFixer] 清理 tools 参数，共 {len(cleaned_tools)} 个工具")
+                tools = data.get("tools")
+                if not tools:
+                    # tools 为 None 或空列表时移除该参数，部分后端会拒绝空的 tools 数组
+                    data.pop("tools")
+                    logger.debug("[HunyuanFixer] 移除空的 tools 参数")
+                else:
+                    if all(self._is_clean_tool(tool) for tool in tools):
+                        # 常见情况：同一套工具定义反复发送且无需清理，直接复用原列表
+                        cleaned_tools = tools
+                    else:
+                        # 非字典的工具定义直接丢弃
+                        cleaned_tools = [self._clean_tool(tool) for tool in tools if type(tool) is dict]
+                    if cleaned_tools:
+                        data["tools"] = cleaned_tools
+                        logger.debug("[HunyuanFixer] 清理 tools 参数，共 %d 个工具", len(cleaned_tools))
+                    else:
+                        data.pop("tools")
+                        logger.debug("[HunyuanFixer] 清理后无有效工具，移除 tools 参数")
         
         return data
@@ -4,12 +4,17 @@
     python main.py
 """
 
+import os
+import logging
 import uvicorn
 import asyncio
 from litellm.proxy.proxy_server import app, initialize
 
 from hunyuan_adapter import setup_callbacks
 
+# 日志级别，设为 DEBUG 可查看逐条消息的处理细节
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+
 # 设置回调
 fixer = setup_callbacks()
 
@@ -26,4 +31,10 @@ async def start_server():
 
 
 if __name__ == "__main__":
-    asyncio.run(start_server())
+    # 可选：安装了 uvloop 时使用基于 libuv 的事件循环，提升 I/O 吞吐
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(start_server())
+    else:
+        uvloop.run(start_server())